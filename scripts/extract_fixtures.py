@@ -1,42 +1,42 @@
 #!/usr/bin/env python3
 """Extract protocol responses from investigation captures to create test fixtures."""
 
-import re
 import struct
 from pathlib import Path
 
 INVESTIGATION_DIR = Path("investigation/data")
 FIXTURES_DIR = Path("tests/fixtures")
 
+_HEX_DIGITS = set("0123456789abcdef")
+
+def _is_hex_dump_line(line):
+    """Check for a "01f0: 0f 00 2f ..." hex dump line without a regex."""
+    return len(line) > 5 and line[4] == ':' and all(c in _HEX_DIGITS for c in line[:4])
+
 def extract_identify_response(source_file, disk_num):
     """Extract 512-byte IDENTIFY response for a specific disk."""
-    with open(source_file, 'r') as f:
-        content = f.read()
-    
-    # Find the IDENTIFY section for this disk
-    pattern = rf"=== IDENTIFY DISK {disk_num} RESPONSE.*?\n((?:[0-9a-f]{{4}}:.*?\n)+)"
-    match = re.search(pattern, content, re.MULTILINE)
-    
-    if not match:
+    header = f"=== IDENTIFY DISK {disk_num} RESPONSE"
+    hex_pairs = []
+    reading = False
+
+    # Stream the capture line-by-line; the hex dump immediately follows
+    # the section header, so stop at the first non-dump line after it.
+    with open(source_file, 'r', buffering=64 * 1024) as f:
+        for line in f:
+            if not reading:
+                if line.startswith(header):
+                    reading = True
+                continue
+            if not _is_hex_dump_line(line):
+                break
+            # Take first 16 hex values (ignore ASCII column)
+            hex_pairs.extend(h for h in line[5:].split()[:16] if len(h) == 2)
+
+    if not hex_pairs:
         return None
-    
-    # Parse hex dump lines
-    hex_lines = match.group(1)
-    bytes_data = bytearray()
-    
-    for line in hex_lines.split('\n'):
-        if not line.strip():
-            continue
-        # Parse: "01f0: 0f 00 2f 00 01 01 00 00 00 80 00 00 dc d4 80 34"
-        parts = line.split(':')
-        if len(parts) != 2:
-            continue
-        hex_bytes = parts[1].split()[:16]  # Take first 16 hex values (ignore ASCII)
-        for hex_byte in hex_bytes:
-            if len(hex_byte) == 2:
-                bytes_data.append(int(hex_byte, 16))
-    
-    return bytes(bytes_data) if len(bytes_data) == 512 else None
+
+    bytes_data = bytes.fromhex("".join(hex_pairs))
+    return bytes_data if len(bytes_data) == 512 else None
 
 def extract_flags(response):
     """Extract RAID flags from IDENTIFY response."""
@@ -49,52 +49,41 @@ def extract_flags(response):
         '0x1FA': response[0x1FA],  # Rebuild phase
     }
 
+# (state name, investigation capture, flags worth reporting for that state)
+STATES = [
+    ("degraded", "degraded_state.txt", ("0x1F0",)),
+    ("healthy", "healthy_state.txt", ("0x1F0", "0x1F5")),
+    ("rebuilding", "rebuilding_state_1.txt", ("0x1F0", "0x1F5", "0x1FA")),
+]
+
 def main():
     print("Extracting test fixtures from investigation data...\n")
     
-    # Create fixture directories
-    (FIXTURES_DIR / "degraded").mkdir(parents=True, exist_ok=True)
-    (FIXTURES_DIR / "healthy").mkdir(parents=True, exist_ok=True)
-    (FIXTURES_DIR / "rebuilding").mkdir(parents=True, exist_ok=True)
+    # Create fixture directories: check the parent once, then each subdir
+    # directly instead of three parents=True descents
+    FIXTURES_DIR.mkdir(parents=True, exist_ok=True)
+    for state_name, _source, _flags in STATES:
+        (FIXTURES_DIR / state_name).mkdir(exist_ok=True)
     
     fixtures_created = 0
-    
-    # Extract DEGRADED state (only disk 0 - representative sample)
-    print("=== Extracting DEGRADED state ===")
-    degraded_file = INVESTIGATION_DIR / "degraded_state.txt"
-    if degraded_file.exists():
-        response = extract_identify_response(degraded_file, 0)
-        if response:
-            output = FIXTURES_DIR / "degraded" / "identify_disk0.bin"
-            output.write_bytes(response)
-            flags = extract_flags(response)
-            print(f"  ✓ Disk 0: {len(response)} bytes, flags: 0x1F0={flags['0x1F0']:02x}")
-            fixtures_created += 1
-    
-    # Extract HEALTHY state (only disk 0 - representative sample)
-    print("\n=== Extracting HEALTHY state ===")
-    healthy_file = INVESTIGATION_DIR / "healthy_state.txt"
-    if healthy_file.exists():
-        response = extract_identify_response(healthy_file, 0)
-        if response:
-            output = FIXTURES_DIR / "healthy" / "identify_disk0.bin"
-            output.write_bytes(response)
-            flags = extract_flags(response)
-            print(f"  ✓ Disk 0: {len(response)} bytes, flags: 0x1F0={flags['0x1F0']:02x}, 0x1F5={flags['0x1F5']:02x}")
-            fixtures_created += 1
-    
-    # Extract REBUILDING state (only disk 0 - representative sample)
-    print("\n=== Extracting REBUILDING state ===")
-    rebuilding_file = INVESTIGATION_DIR / "rebuilding_state_1.txt"
-    if rebuilding_file.exists():
-        response = extract_identify_response(rebuilding_file, 0)
+
+    # Extract each state (only disk 0 - representative sample)
+    for i, (state_name, source_name, flag_keys) in enumerate(STATES):
+        if i:
+            print()
+        print(f"=== Extracting {state_name.upper()} state ===")
+        source_file = INVESTIGATION_DIR / source_name
+        if not source_file.exists():
+            continue
+        response = extract_identify_response(source_file, 0)
         if response:
-            output = FIXTURES_DIR / "rebuilding" / "identify_disk0.bin"
+            output = FIXTURES_DIR / state_name / "identify_disk0.bin"
             output.write_bytes(response)
             flags = extract_flags(response)
-            print(f"  ✓ Disk 0: {len(response)} bytes, flags: 0x1F0={flags['0x1F0']:02x}, 0x1F5={flags['0x1F5']:02x}, 0x1FA={flags['0x1FA']:02x}")
+            flag_summary = ", ".join(f"{key}={flags[key]:02x}" for key in flag_keys)
+            print(f"  ✓ Disk 0: {len(response)} bytes, flags: {flag_summary}")
             fixtures_created += 1
-    
+
     print(f"\n✅ Created {fixtures_created} fixture files in {FIXTURES_DIR}/")
     
     # Create README
@@ -4,11 +4,19 @@ Email notification module for RAID monitor.
 Handles loading config and sending email alerts.
 """
 
+import re
 import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
+from email.message import EmailMessage
 from pathlib import Path
 
+# Matches "key: value" lines (leading whitespace allowed), rejecting
+# comments/blanks in the same pass
+_ENV_RE = re.compile(r"^\s*([^#:\s][^:]*):\s*(.*)$")
+
+_REQUIRED_KEYS = ["smtp_server", "authuser", "authpass"]
+# All keys the mailer reads; once these are found we can stop scanning
+_KNOWN_KEYS = frozenset(_REQUIRED_KEYS + ["ecrypttion"])
+
 
 def load_email_config(env_file):
     """Load email configuration from .env file."""
@@ -19,17 +27,15 @@ def load_email_config(env_file):
         return None, f"Config file not found: {env_file}"
 
     try:
-        with open(env_path, "r") as f:
-            for line in f:
-                line = line.strip()
-                if not line or line.startswith("#"):
-                    continue
-                if ":" in line:
-                    key, value = line.split(":", 1)
-                    config[key.strip()] = value.strip()
-
-        required = ["smtp_server", "authuser", "authpass"]
-        missing = [k for k in required if k not in config]
+        for line in env_path.read_text().splitlines():
+            match = _ENV_RE.match(line)
+            if not match:
+                continue
+            config[match.group(1).strip()] = match.group(2).strip()
+            if _KNOWN_KEYS.issubset(config):
+                break
+
+        missing = [k for k in _REQUIRED_KEYS if k not in config]
         if missing:
             return None, f"Missing required config: {', '.join(missing)}"
 
@@ -38,36 +44,41 @@ def load_email_config(env_file):
         return None, f"Error reading config: {e}"
 
 
-def send_email(config, subject, body, to_address=None):
+def _build_message(config, subject, body, to_address=None):
+    """Build a single-part plaintext message, defaulting the recipient to the sender."""
+    msg = EmailMessage()
+    msg["From"] = config["authuser"]
+    msg["To"] = to_address or config["authuser"]
+    msg["Subject"] = subject
+    msg.set_content(body)
+
+    return msg
+
+
+def send_emails(config, messages):
     """
-    Send email notification.
+    Send one or more email notifications over a single SMTP session.
+
+    The TCP + TLS + AUTH handshake dominates send time, so batching
+    multiple notifications into one session amortizes it.
 
     Args:
         config: Email configuration dict with smtp_server, authuser, authpass, ecrypttion
-        subject: Email subject line
-        body: Email body text
-        to_address: Recipient address (defaults to authuser if None)
+        messages: List of (subject, body) or (subject, body, to_address) tuples
 
     Returns:
         (success: bool, error_message: str or None)
     """
-    try:
-        # Use sender as recipient if not specified
-        recipient = to_address or config["authuser"]
-
-        # Create message
-        msg = MIMEMultipart()
-        msg["From"] = config["authuser"]
-        msg["To"] = recipient
-        msg["Subject"] = subject
-        msg.attach(MIMEText(body, "plain"))
+    if not messages:
+        return True, None
 
+    try:
         # Parse SMTP server and port
         smtp_parts = config["smtp_server"].split(":")
         smtp_server = smtp_parts[0]
         smtp_port = int(smtp_parts[1]) if len(smtp_parts) > 1 else 465
 
-        # Connect and send
+        # Connect once, send everything
         if config.get("ecrypttion") == "ssl":
             server = smtplib.SMTP_SSL(smtp_server, smtp_port, timeout=30)
         else:
@@ -75,7 +86,8 @@ def send_email(config, subject, body, to_address=None):
             server.starttls()
 
         server.login(config["authuser"], config["authpass"])
-        server.send_message(msg)
+        for message in messages:
+            server.send_message(_build_message(config, *message))
         server.quit()
 
         return True, None
@@ -87,6 +99,22 @@ def send_email(config, subject, body, to_address=None):
         return False, f"Unexpected error: {e}"
 
 
+def send_email(config, subject, body, to_address=None):
+    """
+    Send a single email notification.
+
+    Args:
+        config: Email configuration dict with smtp_server, authuser, authpass, ecrypttion
+        subject: Email subject line
+        body: Email body text
+        to_address: Recipient address (defaults to authuser if None)
+
+    Returns:
+        (success: bool, error_message: str or None)
+    """
+    return send_emails(config, [(subject, body, to_address)])
+
+
 if __name__ == "__main__":
     # Simple test when run directly
     import sys
@@ -4,10 +4,15 @@ JMicron RAID State Monitor
 Monitors RAID status flags and sends email alerts on state changes.
 """
 
+import atexit
+import functools
+import heapq
+import json
 import os
 import sys
 import subprocess
 import re
+import time
 from datetime import datetime
 from pathlib import Path
 
@@ -24,19 +29,72 @@ STATE_DIR = MONITOR_DIR / "states"
 LOG_FILE = MONITOR_DIR / "monitor.log"
 LAST_STATE_FILE = MONITOR_DIR / "last_state.txt"
 DISCONNECT_STATE_FILE = MONITOR_DIR / "disconnect_state.txt"
+CAPTURE_CACHE_FILE = MONITOR_DIR / "capture_cache.json"
+CAPTURE_CACHE_OUTPUT = MONITOR_DIR / "capture_cache.txt"
+# RAID state lives inside the controller and is only visible via the mailbox
+# protocol - no host-visible key can observe it changing. Keep the capture
+# cache short-lived, below the smallest supported monitor interval (30s per
+# README; monitor.sh defaults to 60s), so periodic ticks always poll the
+# controller and only genuinely back-to-back runs hit the cache.
+CAPTURE_CACHE_MAX_AGE = 10  # seconds
 ENV_FILE = PROJECT_ROOT / ".env"
+MAX_STATE_FILES = 200
 
 # Ensure directories exist
 STATE_DIR.mkdir(exist_ok=True)
 
+# Precompiled patterns (compiled once at import instead of per call).
+# The raw capture stays as bytes end-to-end, so the dump pattern is a
+# bytes regex; the others run over decoded state files.
+_RE_01F0 = re.compile(rb"^01f0:\s+([0-9a-f ]+)", re.MULTILINE)
+_RE_HEALTH = re.compile(r"0x1F0 \(Health\):\s+([0-9a-f]+)")
+_RE_REBUILD = re.compile(r"0x1F5 \(Rebuild\):\s+([0-9a-f]+)")
+_RE_PHASE = re.compile(r"0x1FA \(Phase\):\s+([0-9a-f]+)")
+_RE_RAW = re.compile(r"Raw:\s+([0-9a-f ]+)")
+
+# Constant notification bodies; only the device and timestamp vary per send
+_DISCONNECT_BODY_TEMPLATE = """RAID Device Disconnect Detected
+
+Device: {device}
+Status: NOT CONNECTED
+
+The RAID device is no longer accessible. This could be due to:
+- USB cable disconnection
+- Enclosure powered off
+- WSL USB passthrough issue
+- Device failure
+
+The monitor will continue checking and notify you when the device reconnects.
+
+Timestamp: {timestamp}
+"""
+
+_RECONNECT_BODY_TEMPLATE = """RAID Device Reconnection Detected
+
+Device: {device}
+Status: CONNECTED
+
+The RAID device is accessible again. Normal monitoring will resume.
+
+Timestamp: {timestamp}
+"""
+
+
+# Log file handle, opened lazily on first log() call and kept open
+# (line-buffered) so each log line costs one write instead of open/write/close
+_LOG_FH = None
+
 
 def log(message):
     """Log message to both console and log file."""
+    global _LOG_FH
     timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
     log_entry = f"[{timestamp}] {message}"
     print(log_entry)
-    with open(LOG_FILE, "a") as f:
-        f.write(log_entry + "\n")
+    if _LOG_FH is None:
+        _LOG_FH = open(LOG_FILE, "a", buffering=1)
+        atexit.register(_LOG_FH.close)
+    _LOG_FH.write(log_entry + "\n")
 
 
 # Email configuration and sending is now handled by email_notifier module
@@ -44,19 +102,16 @@ def log(message):
 
 def is_device_connected():
     """Check if the RAID device exists and is accessible."""
-    device_path = Path(DEVICE)
-    return device_path.exists()
+    return os.path.exists(DEVICE)
 
 
 def get_disconnect_state():
     """Get the last known disconnect state."""
-    if not DISCONNECT_STATE_FILE.exists():
-        return None
-
+    # Open directly rather than exists()-then-open: one syscall, no race
     try:
         with open(DISCONNECT_STATE_FILE, "r") as f:
             return f.read().strip()
-    except Exception:
+    except OSError:
         return None
 
 
@@ -66,14 +121,57 @@ def set_disconnect_state(state):
         f.write(state)
 
 
+def _device_freshness_key():
+    """Cheap freshness key for the device: sysfs stat-file mtime when available."""
+    name = os.path.basename(DEVICE)
+    for path in (f"/sys/block/{name}/stat", DEVICE):
+        try:
+            return os.stat(path).st_mtime
+        except OSError:
+            continue
+    return None
+
+
 def capture_raid_state():
-    """Capture current RAID state using jmraidstatus."""
+    """Capture current RAID state, reusing a recent cached capture."""
+    key = _device_freshness_key()
+    if key is not None:
+        try:
+            cache = json.loads(CAPTURE_CACHE_FILE.read_text())
+            age = time.time() - cache["captured_at"]
+            if cache.get("mtime") == key and 0 <= age < CAPTURE_CACHE_MAX_AGE:
+                log("Using cached RAID state (captured moments ago)")
+                return Path(cache["raw_output_path"]).read_bytes()
+        except (OSError, ValueError, KeyError, TypeError):
+            pass  # No cache, or stale/corrupt cache - fall through to a fresh capture
+
+    raw_output = _run_jmraidstatus()
+
+    if raw_output is not None and key is not None:
+        try:
+            CAPTURE_CACHE_OUTPUT.write_bytes(raw_output)
+            CAPTURE_CACHE_FILE.write_text(
+                json.dumps({
+                    "mtime": key,
+                    "captured_at": time.time(),
+                    "raw_output_path": str(CAPTURE_CACHE_OUTPUT),
+                })
+            )
+        except OSError as e:
+            log(f"WARNING: Could not update capture cache: {e}")
+
+    return raw_output
+
+
+def _run_jmraidstatus():
+    """Invoke jmraidstatus and return its combined output as bytes."""
     try:
-        # Use sudo env to pass environment variable
+        # Use sudo env to pass environment variable.
+        # Output stays as bytes - the flag parsing only needs ASCII hex, so
+        # there is no reason to run the dump through the locale decoder here.
         result = subprocess.run(
             ["sudo", "env", "JMRAIDSTATUS_DUMP_RAW=1", str(JMRAIDSTATUS_BIN), DEVICE],
             capture_output=True,
-            text=True,
             timeout=30
         )
 
@@ -90,16 +188,38 @@ def capture_raid_state():
 
 
 def extract_flags(raw_output):
-    """Extract RAID status flags from raw output."""
-    # Find all 0x1F0 offset lines (one per disk)
-    pattern = r"^01f0:\s+([0-9a-f ]+)"
-    matches = re.findall(pattern, raw_output, re.MULTILINE)
+    """Extract RAID status flags from raw output (bytes or str)."""
+    if isinstance(raw_output, str):
+        raw_output = raw_output.encode("ascii", "replace")
 
-    if not matches:
+    # Stop at the first 0x1F0 offset line; all disks carry the same RAID-wide
+    # flags, so there is no need to regex-collect every match
+    match = _RE_01F0.search(raw_output)
+
+    if not match:
         return None
 
-    # Parse the first disk's flags (all disks should have same RAID-wide flags)
-    hex_bytes = matches[0].split()
+    # Count disks with a C-level substring scan (one 01f0 line per disk)
+    num_disks = raw_output.count(b"\n01f0:") + (1 if raw_output.startswith(b"01f0:") else 0)
+
+    # Parse the first disk's flags
+    line = match.group(1).rstrip().decode("ascii")
+
+    # Each hex byte occupies a fixed 3-char slot ("XX "), so byte N lives at
+    # line[N*3:N*3+2]; slice directly instead of tokenizing with split().
+    # Fall back to split() if the layout looks off.
+    if len(line) >= 17 and line[2] == " ":
+        return {
+            "0x1F0": line[0:2],    # Disk presence bitmask (bit N = disk N present)
+            "0x1F2": line[6:8],    # Unknown
+            "0x1F5": line[15:17],  # Rebuild status (0x00=normal, 0x01=rebuilding)
+            "0x1F9": line[27:29] if len(line) >= 29 else "??",  # Unknown "dirty bit" (0x80=set, 0x00=clear)
+            "0x1FA": line[30:32] if len(line) >= 32 else "??",  # Unknown
+            "raw": line[:35] if len(line) >= 35 else line,
+            "num_disks": num_disks
+        }
+
+    hex_bytes = line.split()
     if len(hex_bytes) < 6:
         return None
 
@@ -110,60 +230,104 @@ def extract_flags(raw_output):
         "0x1F9": hex_bytes[9] if len(hex_bytes) > 9 else "??",  # Unknown "dirty bit" (0x80=set, 0x00=clear)
         "0x1FA": hex_bytes[10] if len(hex_bytes) > 10 else "??",  # Unknown
         "raw": " ".join(hex_bytes[:12]) if len(hex_bytes) >= 12 else " ".join(hex_bytes),
-        "num_disks": len(matches)
+        "num_disks": num_disks
     }
 
     return flags
 
 
-def interpret_state(flags):
-    """Interpret flags into human-readable state."""
-    if not flags:
-        return "UNKNOWN"
-
+@functools.lru_cache(maxsize=64)
+def _interpret_state_cached(health, rebuild):
+    """Build the state string for a (health, rebuild) flag pair."""
     state_parts = []
 
     # RAID health
-    if flags["0x1F0"] == "07":
+    if health == "07":
         state_parts.append("DEGRADED")
-    elif flags["0x1F0"] == "0f":
+    elif health == "0f":
         state_parts.append("OPERATIONAL")
     else:
-        state_parts.append(f"UNKNOWN_HEALTH({flags['0x1F0']})")
+        state_parts.append(f"UNKNOWN_HEALTH({health})")
 
     # Rebuild status
-    if flags["0x1F5"] == "01":
+    if rebuild == "01":
         state_parts.append("REBUILDING")
-    elif flags["0x1F5"] == "00":
+    elif rebuild == "00":
         state_parts.append("NOT_REBUILDING")
     else:
-        state_parts.append(f"UNKNOWN_REBUILD({flags['0x1F5']})")
+        state_parts.append(f"UNKNOWN_REBUILD({rebuild})")
 
     return " + ".join(state_parts)
 
 
+def interpret_state(flags):
+    """Interpret flags into human-readable state."""
+    if not flags:
+        return "UNKNOWN"
+
+    # Flag values come from a tiny set, and interpret_state is called several
+    # times per tick with the same dict - memoize on the hashable pair
+    return _interpret_state_cached(flags["0x1F0"], flags["0x1F5"])
+
+
 def save_state_file(raw_output, flags, state_name):
     """Save state capture to timestamped file."""
+    if isinstance(raw_output, bytes):
+        # Decode once, here, where a human-readable file is actually needed
+        raw_output = raw_output.decode("ascii", "replace")
+
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     filename = STATE_DIR / f"{state_name}_{timestamp}.txt"
 
+    # Join everything and issue one write instead of a dozen
+    lines = [
+        "=== RAID State Capture ===",
+        f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
+        f"State: {interpret_state(flags)}",
+        "",
+        "Flags:",
+        f"  0x1F0 (Health):  {flags['0x1F0']}",
+        f"  0x1F5 (Rebuild): {flags['0x1F5']}",
+        f"  0x1F9 (Dirty?):  {flags['0x1F9']}",
+        f"  0x1FA (Unknown): {flags['0x1FA']}",
+        f"  Raw: {flags['raw']}",
+        f"  Disks: {flags['num_disks']}",
+        "",
+        "=" * 60,
+        "",
+    ]
+
     with open(filename, "w") as f:
-        f.write(f"=== RAID State Capture ===\n")
-        f.write(f"Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-        f.write(f"State: {interpret_state(flags)}\n")
-        f.write(f"\nFlags:\n")
-        f.write(f"  0x1F0 (Health):  {flags['0x1F0']}\n")
-        f.write(f"  0x1F5 (Rebuild): {flags['0x1F5']}\n")
-        f.write(f"  0x1F9 (Dirty?):  {flags['0x1F9']}\n")
-        f.write(f"  0x1FA (Unknown): {flags['0x1FA']}\n")
-        f.write(f"  Raw: {flags['raw']}\n")
-        f.write(f"  Disks: {flags['num_disks']}\n")
-        f.write(f"\n{'='*60}\n\n")
-        f.write(raw_output)
+        f.write("\n".join(lines) + "\n" + raw_output)
+
+    _rotate_states()
 
     return filename
 
 
+def _rotate_states(max_files=MAX_STATE_FILES):
+    """Delete the oldest state captures beyond max_files, keeping states/ bounded."""
+    try:
+        with os.scandir(STATE_DIR) as entries:
+            state_files = [e for e in entries if e.name.endswith(".txt")]
+    except OSError:
+        return
+
+    excess = len(state_files) - max_files
+    if excess <= 0:
+        return
+
+    # Partial sort: only the entries being evicted need ordering
+    oldest = heapq.nsmallest(
+        excess, state_files, key=lambda e: e.stat(follow_symlinks=False).st_mtime
+    )
+    for entry in oldest:
+        try:
+            os.unlink(entry.path)
+        except OSError:
+            pass
+
+
 def load_state_from_file(filepath):
     """Load state from a state file (either last_state.txt or a full state capture)."""
     try:
@@ -182,10 +346,10 @@ def load_state_from_file(filepath):
             }
 
         # Try to parse as formatted state capture (from this monitor)
-        flags_match = re.search(r"0x1F0 \(Health\):\s+([0-9a-f]+)", content)
-        rebuild_match = re.search(r"0x1F5 \(Rebuild\):\s+([0-9a-f]+)", content)
-        phase_match = re.search(r"0x1FA \(Phase\):\s+([0-9a-f]+)", content)
-        raw_match = re.search(r"Raw:\s+([0-9a-f ]+)", content)
+        flags_match = _RE_HEALTH.search(content)
+        rebuild_match = _RE_REBUILD.search(content)
+        phase_match = _RE_PHASE.search(content)
+        raw_match = _RE_RAW.search(content)
 
         if flags_match and rebuild_match:
             return {
@@ -215,21 +379,50 @@ def load_state_from_file(filepath):
 
 def find_most_recent_state_file():
     """Find the most recent state file in the states directory."""
-    if not STATE_DIR.exists():
+    # Single scandir pass with one stat per entry; no full sort and none of
+    # the double-stat overhead of Path.glob + sorted
+    try:
+        with os.scandir(STATE_DIR) as entries:
+            state_files = [e for e in entries if e.name.endswith(".txt")]
+    except OSError:
         return None
 
-    state_files = sorted(STATE_DIR.glob("*.txt"), key=lambda p: p.stat().st_mtime, reverse=True)
-    if state_files:
-        return state_files[0]
-    return None
+    if not state_files:
+        return None
+
+    newest = max(state_files, key=lambda e: e.stat(follow_symlinks=False).st_mtime)
+    return Path(newest.path)
+
+
+# In-process cache of the parsed last_state.txt, keyed by file mtime, so a
+# long-running daemon doesn't re-read and re-parse state it just wrote
+_LAST_STATE_CACHE = {"mtime_ns": None, "flags": None}
+
+
+def _cache_last_state(state):
+    """Remember the parsed last state alongside the file's current mtime."""
+    try:
+        _LAST_STATE_CACHE["mtime_ns"] = os.stat(LAST_STATE_FILE).st_mtime_ns
+        _LAST_STATE_CACHE["flags"] = state
+    except OSError:
+        pass
 
 
 def load_last_state():
     """Load the last known state, checking multiple sources."""
     # First, try to load from last_state.txt
-    if LAST_STATE_FILE.exists():
+    try:
+        st = os.stat(LAST_STATE_FILE)
+    except OSError:
+        st = None
+
+    if st is not None:
+        if _LAST_STATE_CACHE["flags"] and _LAST_STATE_CACHE["mtime_ns"] == st.st_mtime_ns:
+            return _LAST_STATE_CACHE["flags"]
         state = load_state_from_file(LAST_STATE_FILE)
         if state:
+            _LAST_STATE_CACHE["mtime_ns"] = st.st_mtime_ns
+            _LAST_STATE_CACHE["flags"] = state
             log(f"Loaded last state from {LAST_STATE_FILE.name}")
             return state
 
@@ -247,6 +440,7 @@ def load_last_state():
                 f.write(f"0x1FA: {state['0x1FA']}\n")
                 f.write(f"Raw: {state['raw']}\n")
                 f.write(f"File: {state['filename']}\n")
+            _cache_last_state(state)
             log(f"Initialized last_state.txt from {recent_file.name}")
             return state
 
@@ -264,6 +458,14 @@ def save_last_state(flags, filename):
         f.write(f"Raw: {flags['raw']}\n")
         f.write(f"File: {filename}\n")
 
+    _cache_last_state({
+        "0x1F0": flags["0x1F0"],
+        "0x1F5": flags["0x1F5"],
+        "0x1FA": flags["0x1FA"],
+        "raw": flags["raw"],
+        "filename": filename,
+    })
+
 
 def compare_states(old_flags, new_flags):
     """Compare two flag states and return differences."""
@@ -282,11 +484,28 @@ def compare_states(old_flags, new_flags):
         return "NO_CHANGE"
 
 
+def _flush_emails(email_config, pending_emails):
+    """Send any accumulated notifications over a single SMTP session."""
+    if not pending_emails or not email_config:
+        return
+
+    success, error = email_notifier.send_emails(email_config, pending_emails)
+    if success:
+        for subject, _body in pending_emails:
+            log(f"Email sent: {subject}")
+    else:
+        log(f"ERROR sending email(s): {error}")
+    pending_emails.clear()
+
+
 def check_raid_state():
     """Main check function."""
     log("=" * 60)
     log("Starting RAID state check")
 
+    # Notifications queued during this check; flushed in one SMTP session
+    pending_emails = []
+
     # Load email config
     email_config, email_error = email_notifier.load_email_config(ENV_FILE)
     if email_error:
@@ -307,27 +526,13 @@ def check_raid_state():
 
             if email_config:
                 subject = f"RAID Device Disconnected: {DEVICE}"
-                body = f"""RAID Device Disconnect Detected
-
-Device: {DEVICE}
-Status: NOT CONNECTED
-
-The RAID device is no longer accessible. This could be due to:
-- USB cable disconnection
-- Enclosure powered off
-- WSL USB passthrough issue
-- Device failure
-
-The monitor will continue checking and notify you when the device reconnects.
-
-Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-"""
-                success, error = email_notifier.send_email(email_config, subject, body)
-                if success:
-                    log("Disconnect notification email sent")
-                else:
-                    log(f"ERROR sending disconnect email: {error}")
+                body = _DISCONNECT_BODY_TEMPLATE.format(
+                    device=DEVICE,
+                    timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                )
+                pending_emails.append((subject, body))
 
+        _flush_emails(email_config, pending_emails)
         log("Check complete (device disconnected)")
         log("=" * 60)
         return False
@@ -339,31 +544,24 @@ Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 
         if email_config:
             subject = f"RAID Device Reconnected: {DEVICE}"
-            body = f"""RAID Device Reconnection Detected
-
-Device: {DEVICE}
-Status: CONNECTED
-
-The RAID device is accessible again. Normal monitoring will resume.
-
-Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
-"""
-            success, error = email_notifier.send_email(email_config, subject, body)
-            if success:
-                log("Reconnect notification email sent")
-            else:
-                log(f"ERROR sending reconnect email: {error}")
+            body = _RECONNECT_BODY_TEMPLATE.format(
+                device=DEVICE,
+                timestamp=datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            )
+            pending_emails.append((subject, body))
 
     # Capture current state
     raw_output = capture_raid_state()
     if not raw_output:
         log("ERROR: Failed to capture RAID state")
+        _flush_emails(email_config, pending_emails)
         return False
 
     # Extract flags
     current_flags = extract_flags(raw_output)
     if not current_flags:
         log("ERROR: Failed to extract flags from output")
+        _flush_emails(email_config, pending_emails)
         return False
 
     current_state = interpret_state(current_flags)
@@ -378,14 +576,18 @@ Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
     comparison = compare_states(last_flags, current_flags)
     log(f"Comparison: {comparison}")
 
-    # Save state file
-    state_filename = save_state_file(raw_output, current_flags, current_state.lower().replace(" + ", "_"))
-    log(f"State saved to: {state_filename}")
+    # Save state file (skip on NO_CHANGE - no point filling the states dir
+    # with identical captures every tick)
+    state_filename = None
+    if comparison != "NO_CHANGE":
+        state_filename = save_state_file(raw_output, current_flags, current_state.lower().replace(" + ", "_"))
+        log(f"State saved to: {state_filename}")
 
     # Log comparison details
     if last_flags:
         log(f"Last state: {last_state} (from {last_flags.get('filename', 'unknown')})")
-        log(f"Current state: {current_state} (saved to {state_filename.name})")
+        if state_filename:
+            log(f"Current state: {current_state} (saved to {state_filename.name})")
 
     # Check for state change
     if comparison not in ["NO_CHANGE", "FIRST_CHECK"]:
@@ -416,21 +618,23 @@ Current capture:  {state_filename.name}
 
 Timestamp: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}
 """
-            success, error = email_notifier.send_email(email_config, subject, body)
-            if success:
-                log(f"Email sent: {subject}")
-            else:
-                log(f"ERROR sending email: {error}")
+            pending_emails.append((subject, body))
         else:
             log("WARNING: Email notification skipped (no config)")
 
-    # Save as last state
-    save_last_state(current_flags, state_filename.name)
+    # Save as last state (skip the rewrite when nothing changed)
+    if comparison != "NO_CHANGE":
+        save_last_state(current_flags, state_filename.name)
+    elif not LAST_STATE_FILE.exists():
+        save_last_state(current_flags, last_flags.get("filename", "unknown"))
 
     # Mark device as connected
     if last_disconnect_state != "connected":
         set_disconnect_state("connected")
 
+    # One SMTP session for everything queued this tick (reconnect + change)
+    _flush_emails(email_config, pending_emails)
+
     log("Check complete")
     log("=" * 60)
 